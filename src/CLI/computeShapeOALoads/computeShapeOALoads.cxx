@@ -6,48 +6,80 @@
 #include "vtkPolyDataReader.h"
 #include "computeShapeOALoadsCLP.h"
 #include <fstream>
+#include <vector>
+#include <stdint.h>
 #include "vtkSmartPointer.h"
 
 using namespace statismo;
 typedef vtkStandardMeshRepresenter RepresenterType;
 typedef StatisticalModel<vtkPolyData> StatisticalModelType;
 
+vtkSmartPointer<vtkPolyData> loadVTKPolyData(const std::string& filename) {
+    vtkSmartPointer<vtkPolyDataReader> reader = vtkSmartPointer<vtkPolyDataReader>::New();
+    reader->SetFileName(filename.c_str());
+    reader->Update();
+    vtkSmartPointer<vtkPolyData> pd = vtkSmartPointer<vtkPolyData>::New();
+    pd->ShallowCopy(reader->GetOutput());
+    return pd;
+}
+
 int main(int argc, char ** argv)
 {
     PARSE_ARGS;
     
-    if(argc < 9)
+    if(argc < 9 || (vtkfile.empty() && vtkfilelist.empty()))
     {
-        std::cout << "Usage " << argv[0] << " [--groupnumber <int>] [--shapemodel <std::string>] [--vtkfile <std::string>] [--resultdir <std::string>]" << std::endl;
+        std::cout << "Usage " << argv[0] << " [--groupnumber <int>] [--shapemodel <std::string>] [--vtkfile <std::string> | --vtkfilelist <std::vector<std::string>>] [--resultdir <std::string>]" << std::endl;
         return 1;
     }
 
+    // List of the samples: the sample given by --vtkfile or all the samples given by --vtkfilelist
+    std::vector<std::string> vtkList = vtkfilelist;
+    if(vtkList.empty())
+    {
+        vtkList.push_back(vtkfile);
+    }
     
     // Load h5 file
+    //   The shape model is loaded only once, whatever the number of samples to project
     RepresenterType* representer = RepresenterType::Create();
     boost::scoped_ptr<StatisticalModelType> model(StatisticalModelType::Load(representer, shapemodel));
     
-    // Load VTK data into program
-    vtkSmartPointer<vtkPolyDataReader> reader = vtkSmartPointer<vtkPolyDataReader>::New();
-    reader->SetFileName(vtkfile.c_str());
-    reader->Update();
-    vtkSmartPointer<vtkPolyData> VTKShape = vtkSmartPointer<vtkPolyData>::New();
-    VTKShape->ShallowCopy(reader->GetOutput());
-    
-    // Compute shape loads for current training model
-    VectorType ShapeOAVectorLoads = model->ComputeCoefficientsForDataset(VTKShape);
-    
-    // Store the shape loads in a csv file
-    ofstream myfile;
-    std::string csvfile = resultdir + "/ShapeOAVectorLoadsG" + std::to_string(groupnumber) + ".csv";
-    myfile.open(csvfile);
-    myfile << "ShapeOALoads" << std::endl;
-    for(int i = 0; i < ShapeOAVectorLoads.size(); i++)
+    // Store the shape loads in a binary file as a matrix samples x shape loads
+    //   Header: number of samples and number of shape loads (int64)
+    //   Then the shape loads of each sample, in the order of the list (float64, row by row)
+    //   The values are written without any text conversion: they are read back exactly
+    std::string binfile = resultdir + "/ShapeOAVectorLoadsG" + std::to_string(groupnumber) + ".bin";
+    std::ofstream myfile(binfile.c_str(), std::ios::out | std::ios::binary);
+    int64_t header[2];
+    header[0] = vtkList.size();
+    header[1] = model->GetNumberOfPrincipalComponents();
+    myfile.write(reinterpret_cast<const char*>(header), sizeof(header));
+
+    std::vector<double> rowLoads(header[1]);
+    for(int j = 0; j < vtkList.size(); j++)
     {
-        myfile << ShapeOAVectorLoads[i] << std::endl;
+        // Load VTK data into program
+        vtkSmartPointer<vtkPolyData> VTKShape = loadVTKPolyData(vtkList[j]);
+
+        // Compute shape loads for current training model
+        VectorType ShapeOAVectorLoads = model->ComputeCoefficientsForDataset(VTKShape);
+        for(int i = 0; i < header[1]; i++)
+        {
+            rowLoads[i] = ShapeOAVectorLoads[i];
+        }
+        if(!rowLoads.empty())
+        {
+            myfile.write(reinterpret_cast<const char*>(&rowLoads[0]), rowLoads.size() * sizeof(double));
+        }
     }
     myfile.close();
-    std::cout << "Successfully saved shape model as " << "ShapeOAVectorLoadsG" << groupnumber << ".csv" << std::endl;
+    if(!myfile)
+    {
+        std::cerr << "Failed to write " << binfile << std::endl;
+        return 1;
+    }
+    std::cout << "Successfully saved shape loads as " << "ShapeOAVectorLoadsG" << groupnumber << ".bin" << std::endl;
 
     
     return 0;
@@ -9,6 +9,8 @@
 #include "saveModelCLP.h"
 #include <fstream>
 #include "vtkCellArray.h"
+#include "vtkDoubleArray.h"
+#include <vector>
 
 using namespace statismo;
 typedef vtkStandardMeshRepresenter RepresenterType;
@@ -35,62 +37,79 @@ int main(int argc, char ** argv)
         return 1;
     }
 
-    // Average of all the VTK meshes
-    //   Mean of the 3 coordinates
+    // Each VTK mesh is read only once:
+    //   the coordinates of all the meshes are copied in one contiguous buffer (numMeshes x numPts x 3)
+    //   used to compute the mean and to give the datasets to the data manager
+    int numMeshes = vtkfilelist.size();
     vtkSmartPointer<vtkPolyData> polydata0 = loadVTKPolyData(vtkfilelist[0]);
-    int numPts = loadVTKPolyData(vtkfilelist[0])->GetPoints()->GetNumberOfPoints();
-    vtkSmartPointer<vtkCellArray> verts = polydata0->GetVerts();
-    vtkSmartPointer<vtkCellArray> lines = polydata0->GetLines();
-    vtkSmartPointer<vtkCellArray> polys = polydata0->GetPolys();
-    vtkSmartPointer<vtkCellArray> strips = polydata0->GetStrips();
-
-    vtkSmartPointer<vtkPolyData> polydata_MeanGroup = vtkSmartPointer<vtkPolyData>::New();
-    vtkSmartPointer<vtkPoints> points = vtkSmartPointer<vtkPoints>::New();
-    points = polydata0->GetPoints();
-    for(int meshID = 1; meshID < vtkfilelist.size(); meshID++)
+    int numPts = polydata0->GetNumberOfPoints();
+    std::vector<double> coordinates(static_cast<size_t>(numMeshes) * numPts * 3);
+    for(int meshID = 0; meshID < numMeshes; meshID++)
     {
-        vtkSmartPointer<vtkPolyData> polydata = vtkSmartPointer<vtkPolyData>::New();
-        polydata = loadVTKPolyData(vtkfilelist[meshID]);
+        vtkSmartPointer<vtkPolyData> polydata = meshID == 0 ? polydata0 : loadVTKPolyData(vtkfilelist[meshID]);
+        if(polydata->GetNumberOfPoints() != numPts)
+        {
+            std::cerr << "The mesh " << vtkfilelist[meshID] << " has " << polydata->GetNumberOfPoints()
+                      << " points instead of " << numPts << std::endl;
+            return 1;
+        }
+        vtkDataArray* pointsData = polydata->GetPoints()->GetData();
+        double* meshCoordinates = &coordinates[static_cast<size_t>(meshID) * numPts * 3];
         for(int ptID = 0; ptID < numPts; ptID++)
         {
-            double coord[3];
-            polydata->GetPoint(ptID, coord);
-            double sum[3];
-            points->GetPoint(ptID, sum);
-            for(int dim = 0; dim < 3; dim++)
-            {
-                sum[dim] = sum[dim] + coord[dim];
-            }
-            points->InsertPoint(ptID, sum);
+            pointsData->GetTuple(ptID, meshCoordinates + 3 * ptID);
+        }
+    }
+
+    // Average of all the VTK meshes
+    //   Mean of the 3 coordinates
+    std::vector<double> sum(static_cast<size_t>(numPts) * 3, 0.0);
+    for(int meshID = 0; meshID < numMeshes; meshID++)
+    {
+        const double* meshCoordinates = &coordinates[static_cast<size_t>(meshID) * numPts * 3];
+        for(int i = 0; i < numPts * 3; i++)
+        {
+            sum[i] += meshCoordinates[i];
         }
     }
-    double mean[3];
+    vtkSmartPointer<vtkPoints> points = vtkSmartPointer<vtkPoints>::New();
+    points->SetDataTypeToDouble();
+    points->SetNumberOfPoints(numPts);
     for(int ptID = 0; ptID < numPts; ptID++)
     {
+        double mean[3];
         for(int dim = 0; dim < 3; dim++)
         {
-            double sum[3];
-            points->GetPoint(ptID, sum);
-            mean[dim] = sum[dim]/vtkfilelist.size();
+            mean[dim] = sum[3 * ptID + dim]/numMeshes;
         }
-        points->InsertPoint(ptID, mean);
+        points->SetPoint(ptID, mean);
     }
 
     //   Creation of the polydata of the mean of the given group
+    vtkSmartPointer<vtkPolyData> polydata_MeanGroup = vtkSmartPointer<vtkPolyData>::New();
     polydata_MeanGroup->SetPoints(points);
-    polydata_MeanGroup->SetVerts(verts);
-    polydata_MeanGroup->SetLines(lines);
-    polydata_MeanGroup->SetPolys(polys);
-    polydata_MeanGroup->SetStrips(strips);
+    polydata_MeanGroup->SetVerts(polydata0->GetVerts());
+    polydata_MeanGroup->SetLines(polydata0->GetLines());
+    polydata_MeanGroup->SetPolys(polydata0->GetPolys());
+    polydata_MeanGroup->SetStrips(polydata0->GetStrips());
 
     // Creation of the shape model
     vtkSmartPointer<vtkPolyData> reference = polydata_MeanGroup;
 
     boost::scoped_ptr<RepresenterType> representer(RepresenterType::Create(reference));
     boost::scoped_ptr<DataManagerType> dataManager(DataManagerType::Create(representer.get()));
-    for(int j = 0; j < vtkfilelist.size(); j++)
+    for(int j = 0; j < numMeshes; j++)
     {
-        dataManager->AddDataset(loadVTKPolyData(vtkfilelist[j]), vtkfilelist[j]);
+        //   The points of the dataset use the coordinates of the buffer without copy
+        vtkSmartPointer<vtkDoubleArray> pointsData = vtkSmartPointer<vtkDoubleArray>::New();
+        pointsData->SetNumberOfComponents(3);
+        pointsData->SetArray(&coordinates[static_cast<size_t>(j) * numPts * 3], static_cast<vtkIdType>(numPts) * 3, 1);
+        vtkSmartPointer<vtkPoints> datasetPoints = vtkSmartPointer<vtkPoints>::New();
+        datasetPoints->SetData(pointsData);
+        vtkSmartPointer<vtkPolyData> dataset = vtkSmartPointer<vtkPolyData>::New();
+        dataset->SetPoints(datasetPoints);
+        dataset->SetPolys(polydata0->GetPolys());
+        dataManager->AddDataset(dataset, vtkfilelist[j]);
     }
     boost::scoped_ptr<ModelBuilderType> modelBuilder(ModelBuilderType::Create());
     boost::scoped_ptr<StatisticalModelType> model(modelBuilder->BuildNewModel(dataManager->GetData(), 0.01));
@@ -0,0 +1,54 @@
+# Batch mode of DiagnosticIndex: define the OA index type of patients without the interface
+#
+# Usage:
+#    Slicer --no-main-window --python-script DiagnosticIndexBatch.py
+#           --groups <ClassificationGroups.csv or Groups.csv>
+#           --patients <CSV file containing the vtk files of the patients>
+#           --output <OAResult.csv>
+#           [--workers <number of CLIs running at the same time>]
+#           [--profile <profile.json>] [--trace <trace.json>]
+#
+#    If the CSV file given with --groups contains vtk files (Groups.csv), the shape models of
+#    the Classification Groups are built first.
+#    --profile and --trace save the time spent and the memory used by each stage and each CLI (see Profiler),
+#    in JSON or in the Chrome trace format (chrome://tracing or Perfetto).
+
+import sys
+import argparse
+from __main__ import slicer
+from DiagnosticIndex import DiagnosticIndexLogic
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Define the OA index type of patients without the interface')
+    parser.add_argument('--groups', required=True,
+                        help='CSV file containing the Classification Groups (ClassificationGroups.csv) '
+                             'or the vtk files used to create them (Groups.csv)')
+    parser.add_argument('--patients', required=True, help='CSV file containing the vtk files of the patients')
+    parser.add_argument('--output', required=True, help='CSV file where the result is saved (OAResult.csv)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of CLIs running at the same time')
+    parser.add_argument('--profile', default=None, help='JSON file where the time spent in each stage is saved')
+    parser.add_argument('--trace', default=None, help='JSON file where the time spent in each stage is saved '
+                                                      'in the Chrome trace format')
+    args = parser.parse_args(argv)
+
+    logic = DiagnosticIndexLogic()
+    if args.workers is not None:
+        logic.numberOfWorkers = max(1, args.workers)
+
+    try:
+        if not logic.classifyPatients(args.groups, args.patients, args.output):
+            return 1
+        return 0
+    finally:
+        # Remove the scratch directory of this run
+        logic.removeWorkspace()
+        if args.profile:
+            logic.profiler.exportJSON(args.profile)
+        if args.trace:
+            logic.profiler.exportChromeTrace(args.trace)
+
+
+if __name__ == '__main__':
+    # The arguments given to Slicer after the script are in sys.argv
+    sys.exit(main(sys.argv[1:]))
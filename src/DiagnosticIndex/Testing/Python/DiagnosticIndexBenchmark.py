@@ -0,0 +1,269 @@
+# Benchmark of DiagnosticIndex on synthetic Classification Groups
+#
+# Usage:
+#    Slicer --no-main-window --python-script DiagnosticIndexBenchmark.py
+#           --output <benchmark.json>
+#           [--points <number of points of each mesh>] [--groups <number of groups>]
+#           [--group-size <number of meshes per group>] [--patients <number of patients>]
+#           [--repeat <number of runs>] [--seed <seed of the random generator>] [--binary]
+#           [--workers <number of CLIs running at the same time>] [--directory <working directory>] [--keep]
+#
+#    The meshes are spheres in correspondence (same points and cells): each group is stretched along one axis,
+#    each mesh is perturbed randomly and carries point data, like the meshes exported by the users.
+#    Each stage is timed separately and the durations are saved in a JSON file, with the parameters and the commit,
+#    to compare the results of two commits with the same parameters.
+
+import os
+import sys
+import csv
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+import numpy
+from __main__ import vtk, slicer
+from vtk.util import numpy_support
+from DiagnosticIndex import DiagnosticIndexLogic, VTKFilesCatalogue, StrippedMeshCache, h5py
+
+
+# Function to create the sphere used as reference for all the meshes
+#    The number of points of the sphere is resolution^2 + 2, the closest to numberOfPoints
+def createReferenceSphere(numberOfPoints):
+    resolution = max(3, int(round(math.sqrt(max(numberOfPoints - 2, 1)))))
+    sphere = vtk.vtkSphereSource()
+    sphere.SetThetaResolution(resolution)
+    sphere.SetPhiResolution(resolution + 2)
+    sphere.Update()
+    return sphere.GetOutput()
+
+
+# Function to create the meshes of the groups and the patients, and the CSV files giving them
+#    Return the paths of the CSV file of the groups (Groups.csv) and of the CSV file of the patients
+def createSyntheticData(logic, directory, args):
+    randomState = numpy.random.RandomState(args.seed)
+    reference = createReferenceSphere(args.points)
+    referencePoints = numpy_support.vtk_to_numpy(reference.GetPoints().GetData()).astype(numpy.float64)
+
+    def createMesh(group, filepath):
+        # Each group is stretched along one axis, each mesh has its own scale and noise on the points
+        scale = numpy.ones(3) + randomState.normal(0, 0.02, 3)
+        scale[(group - 1) % 3] += 0.1 * ((group - 1) // 3 + 1)
+        noise = 1 + randomState.normal(0, 0.005, (referencePoints.shape[0], 1))
+        polydata = vtk.vtkPolyData()
+        polydata.DeepCopy(reference)
+        points = numpy_support.numpy_to_vtk(referencePoints * scale * noise, deep=1)
+        polydata.GetPoints().SetData(points)
+        thickness = numpy_support.numpy_to_vtk(randomState.uniform(0, 1, referencePoints.shape[0]), deep=1)
+        thickness.SetName('Thickness')
+        polydata.GetPointData().AddArray(thickness)
+
+        writer = vtk.vtkPolyDataWriter()
+        writer.SetFileName(filepath)
+        if args.binary:
+            writer.SetFileTypeToBinary()
+        if vtk.VTK_MAJOR_VERSION <= 5:
+            writer.SetInput(polydata)
+        else:
+            writer.SetInputData(polydata)
+        writer.Write()
+
+    dictGroups = dict()
+    for group in range(1, args.groups + 1):
+        groupDirectory = os.path.join(directory, 'Group' + str(group))
+        os.makedirs(groupDirectory)
+        dictGroups[group] = list()
+        for index in range(args.group_size):
+            filepath = os.path.join(groupDirectory, 'G' + str(group) + '_' + str(index) + '.vtk')
+            createMesh(group, filepath)
+            dictGroups[group].append(filepath)
+    logic.creationCSVFile(directory, 'Groups.csv', dictGroups, "Groups")
+
+    patientDirectory = os.path.join(directory, 'Patients')
+    os.makedirs(patientDirectory)
+    patientCSVFile = os.path.join(directory, 'Patients.csv')
+    file = open(patientCSVFile, 'w')
+    cw = csv.writer(file, delimiter=',')
+    cw.writerow(['VTK Files'])
+    for index in range(args.patients):
+        filepath = os.path.join(patientDirectory, 'Patient' + str(index) + '.vtk')
+        createMesh(randomState.randint(1, args.groups + 1), filepath)
+        cw.writerow([filepath])
+    file.close()
+    return os.path.join(directory, 'Groups.csv'), patientCSVFile
+
+
+# Durations of the stages of one run
+class Timer(object):
+    def __init__(self):
+        self.durations = dict()
+
+    # Function to time a stage: call function(*arguments) and return its result
+    def run(self, stage, function, *arguments):
+        print "--- Benchmark: " + stage + " ---"
+        start = time.time()
+        result = function(*arguments)
+        self.durations[stage] = time.time() - start
+        print "--- Benchmark: " + stage + " done in %.3fs ---" % self.durations[stage]
+        return result
+
+
+# Function to run once all the stages, from the CSV file of the groups to the OA index of the patients
+#    Return the durations of the stages
+def runStages(logic, directory, groupsCSVFile, patientCSVFile):
+    timer = Timer()
+    logic.shapeModelCache.clear()
+    # The vtk files without arrays are created again at each run
+    logic.strippedMeshCache = StrippedMeshCache(tempfile.mkdtemp(prefix='MeshCache-', dir=directory))
+
+    # CSV ingestion
+    def ingestCSVFile():
+        logic.table = logic.readCSVFile(groupsCSVFile)
+        dictVTKFiles = VTKFilesCatalogue()
+        if not (logic.creationDictVTKFiles(dictVTKFiles) and logic.checkSeveralMeshInDict(dictVTKFiles)):
+            raise RuntimeError('The CSV file of the groups cannot be read')
+        return dictVTKFiles
+    dictVTKFiles = timer.run('CSV ingestion', ingestCSVFile)
+
+    # Pre-flight check of the points and cells
+    def checkMeshes():
+        vtkList = [vtkFile for value in dictVTKFiles.values() for vtkFile in value]
+        return logic.checkMeshCorrespondence(dictVTKFiles, logic.readMeshHeaders(vtkList))
+    if timer.run('pre-flight', checkMeshes):
+        raise RuntimeError('The synthetic meshes are not in correspondence')
+
+    # Remove the arrays
+    def deleteArrays():
+        dictStrippedVTKFiles = dict()
+        for key, value in dictVTKFiles.items():
+            dictStrippedVTKFiles[key] = logic.deleteArrays(key, value)
+        return dictStrippedVTKFiles
+    dictStrippedVTKFiles = timer.run('deleteArrays', deleteArrays)
+
+    # Shape models, all built by saveModel
+    def buildShapeModels():
+        resultdir = logic.createScratchDirectory('ShapeModels-')
+        dictErrors = logic.updateShapeModels(dictStrippedVTKFiles, dict(), resultdir)
+        dictShapeModels = dict()
+        for key in dictStrippedVTKFiles.keys():
+            if dictErrors.get(key, None):
+                raise RuntimeError('The shape model of the group ' + str(key) + ' has not been built: ' + dictErrors[key])
+            logic.storeShapeModel(dictShapeModels, key, resultdir)
+        return dictShapeModels
+    dictShapeModels = timer.run('saveModel', buildShapeModels)
+
+    # Incremental update: one vtk file moved from the first group to the second one
+    #    The statistics of the shape models built by saveModel are recovered from their hdf5 files by the update
+    if logic.useNumPyEngine() and len(dictStrippedVTKFiles) > 1:
+        keyList = sorted(dictStrippedVTKFiles.keys())
+        dictMovedVTKFiles = dict(dictStrippedVTKFiles)
+        dictMovedVTKFiles[keyList[0]] = dictStrippedVTKFiles[keyList[0]][1:]
+        dictMovedVTKFiles[keyList[1]] = dictStrippedVTKFiles[keyList[1]] + dictStrippedVTKFiles[keyList[0]][:1]
+
+        def updateShapeModels():
+            resultdir = logic.createScratchDirectory('ShapeModels-')
+            logic.updateShapeModels(dictMovedVTKFiles, dictShapeModels, resultdir)
+            shutil.rmtree(resultdir, True)
+        timer.run('updateShapeModels', updateShapeModels)
+
+    # Means
+    def computeMeans():
+        logic.removeDataMeans(logic.computeMeans(dictShapeModels))
+    timer.run('computeMean', computeMeans)
+    if h5py is not None:
+        timer.run('meanPolyData', lambda: [logic.meanPolyData(h5path) for h5path in dictShapeModels.values()])
+
+    # Shape OA loads of the patients
+    patientList = logic.creationPatientList(patientCSVFile)
+    useInProcessProjection = logic.useInProcessProjection
+    logic.useInProcessProjection = False
+    dictShapeOALoads = timer.run('computeShapeOALoads', logic.computeShapeOALoadsForAllGroups, dictShapeModels, patientList)
+    logic.useInProcessProjection = useInProcessProjection
+    if h5py is not None:
+        dictShapeOALoads = timer.run('computeShapeOALoadsInProcess', logic.computeShapeOALoadsInProcess,
+                                     dictShapeModels, patientList)
+
+    # OA index
+    if timer.run('computeOAIndex', logic.computeOAIndex, sorted(dictShapeModels.keys()), dictShapeOALoads) is None:
+        raise RuntimeError('The OA index of the patients has not been computed')
+
+    logic.removeDataAfterNCG(dictShapeModels)
+    return timer.durations
+
+
+# Function to recover the commit of the sources of the benchmark, None if git is not available
+def currentCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark of DiagnosticIndex on synthetic Classification Groups')
+    parser.add_argument('--output', required=True, help='JSON file where the durations of the stages are saved')
+    parser.add_argument('--points', type=int, default=1002, help='Number of points of each mesh')
+    parser.add_argument('--groups', type=int, default=3, help='Number of groups')
+    parser.add_argument('--group-size', type=int, default=20, help='Number of meshes per group')
+    parser.add_argument('--patients', type=int, default=20, help='Number of patients')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of all the stages')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    parser.add_argument('--binary', action='store_true', help='Save the meshes in binary format (ASCII by default)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of CLIs running at the same time')
+    parser.add_argument('--directory', default=None, help='Directory where the synthetic data are created')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic data at the end')
+    args = parser.parse_args(argv)
+    if args.groups < 2 or args.group_size < 3:
+        parser.error('At least two groups of three meshes are needed')
+
+    logic = DiagnosticIndexLogic()
+    if args.workers is not None:
+        logic.numberOfWorkers = max(1, args.workers)
+
+    directory = tempfile.mkdtemp(prefix='DiagnosticIndexBenchmark-', dir=args.directory)
+    try:
+        start = time.time()
+        groupsCSVFile, patientCSVFile = createSyntheticData(logic, directory, args)
+        generationDuration = time.time() - start
+
+        runs = list()
+        for run in range(args.repeat):
+            print "------ Benchmark: run " + str(run + 1) + "/" + str(args.repeat) + " ------"
+            runs.append(runStages(logic, directory, groupsCSVFile, patientCSVFile))
+    finally:
+        logic.removeWorkspace()
+        if not args.keep:
+            shutil.rmtree(directory, True)
+
+    stages = dict()
+    for stage in runs[0].keys():
+        durations = [durations[stage] for durations in runs]
+        stages[stage] = {'durations': durations, 'min': min(durations), 'median': float(numpy.median(durations))}
+
+    result = {
+        'commit': currentCommit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': {'points': createReferenceSphere(args.points).GetNumberOfPoints(), 'groups': args.groups,
+                       'groupSize': args.group_size, 'patients': args.patients, 'repeat': args.repeat,
+                       'seed': args.seed, 'binary': args.binary, 'workers': logic.numberOfWorkers},
+        'environment': {'platform': platform.platform(), 'python': platform.python_version(),
+                        'vtk': vtk.vtkVersion.GetVTKVersion(), 'numpy': numpy.__version__,
+                        'h5py': h5py.__version__ if h5py is not None else None,
+                        'slicer': slicer.app.applicationVersion},
+        'generation': generationDuration,
+        'stages': stages,
+    }
+    file = open(args.output, 'w')
+    json.dump(result, file, indent=2, sort_keys=True)
+    file.close()
+    print "Export JSON File: " + args.output
+    return 0
+
+
+if __name__ == '__main__':
+    # The arguments given to Slicer after the script are in sys.argv
+    sys.exit(main(sys.argv[1:]))